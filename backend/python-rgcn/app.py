@@ -3,19 +3,25 @@ FastAPI service for R-GCN embeddings and similarity search.
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Literal
 import torch
 import os
 from dotenv import load_dotenv
 from datetime import datetime
 import json
 import random
+import asyncio
+import threading
+import base64
 
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 
 from services.neo4j_connector import Neo4jConnector
+from services.embedding_service import EmbeddingService
+from services.request_batcher import RequestBatcher
 from models.rgcn_model import RGCNModel, RGCNTrainer
 
 load_dotenv()
@@ -35,12 +41,18 @@ app.add_middleware(
 neo4j_connector: Optional[Neo4jConnector] = None
 model: Optional[RGCNModel] = None
 trainer: Optional[RGCNTrainer] = None
+embedding_service: Optional[EmbeddingService] = None
+embeddings_batcher: Optional[RequestBatcher] = None
+similarity_batcher: Optional[RequestBatcher] = None
 node_to_entity: Dict[int, str] = {}
 entity_to_node: Dict[str, int] = {}
 graph_data_cache: Optional[Dict] = None
+training_lock = threading.Lock()
+stats_lock = threading.Lock()
 stats = {
     "total_queries": 0,
     "avg_similarity": 0.0,
+    "similarity_samples": 0,
     "embeddings_count": 0
 }
 
@@ -48,6 +60,8 @@ stats = {
 # Request/Response models
 class EmbeddingRequest(BaseModel):
     entity_ids: List[str]
+    # "float16" returns each embedding as base64-encoded little-endian float16 bytes
+    encoding: Literal["json", "float16"] = "json"
 
 
 class SimilarityRequest(BaseModel):
@@ -66,10 +80,19 @@ class EvaluateRequest(BaseModel):
     max_nodes: int = 100
 
 
+def _graph_tensor(array: np.ndarray, device: torch.device) -> torch.Tensor:
+    """Wrap an int64 graph array as a tensor on device without an extra host copy."""
+    tensor = torch.from_numpy(np.ascontiguousarray(array, dtype=np.int64))
+    if device.type == "cuda":
+        return tensor.pin_memory().to(device, non_blocking=True)
+    return tensor
+
+
 @app.on_event("startup")
 async def startup():
     """Initialize connections and load model on startup."""
-    global neo4j_connector, model, trainer, node_to_entity, entity_to_node, graph_data_cache
+    global neo4j_connector, model, trainer, embedding_service, embeddings_batcher, similarity_batcher
+    global node_to_entity, entity_to_node, graph_data_cache
     
     print("[R-GCN] Starting up...")
     
@@ -106,12 +129,21 @@ async def startup():
     embedding_dim = int(os.getenv("RGCN_EMBEDDING_DIM", "64"))
     hidden_dim = int(os.getenv("RGCN_HIDDEN_DIM", "128"))
     num_layers = int(os.getenv("RGCN_NUM_LAYERS", "2"))
+    # Basis decomposition is opt-in: it changes parameter shapes, so existing checkpoints won't load
+    num_bases = int(os.getenv("RGCN_NUM_BASES", "0")) or None
+    
+    # Run on the GPU when one is available
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"[R-GCN] Using device: {device}")
     
-    model = RGCNModel(num_nodes, num_relations, embedding_dim, hidden_dim, num_layers)
+    # Allow TF32 matmuls on GPUs that support them
+    torch.set_float32_matmul_precision("high")
     
-    # Convert graph data to tensors
-    edge_index = torch.tensor(graph_data_cache["edges"], dtype=torch.long)
-    edge_type = torch.tensor(graph_data_cache["edge_types"], dtype=torch.long)
+    model = RGCNModel(num_nodes, num_relations, embedding_dim, hidden_dim, num_layers, num_bases).to(device)
+    
+    # Convert graph data to tensors (zero-copy on CPU, pinned async upload on GPU)
+    edge_index = _graph_tensor(graph_data_cache["edges"], device)
+    edge_type = _graph_tensor(graph_data_cache["edge_types"], device)
     
     # Initialize trainer
     trainer = RGCNTrainer(model, edge_index, edge_type)
@@ -120,7 +152,7 @@ async def startup():
     model_path = os.getenv("RGCN_MODEL_PATH", "model.pt")
     if os.path.exists(model_path) and not os.getenv("RGCN_FORCE_RETRAIN", "false").lower() == "true":
         try:
-            model.load_state_dict(torch.load(model_path, map_location='cpu'))
+            model.load_state_dict(torch.load(model_path, map_location=device))
             print(f"[R-GCN] Loaded pre-trained model from {model_path}")
         except Exception as e:
             print(f"[R-GCN] Could not load model: {e}. Will use untrained model.")
@@ -128,12 +160,51 @@ async def startup():
         print("[R-GCN] No pre-trained model found. Model will use random initialization.")
     
     model.eval()
+    
+    # Shared embedding service; runs the R-GCN forward pass and builds the
+    # embedding cache (and ANN index) once up front
+    ann_min_nodes = int(os.getenv("RGCN_ANN_MIN_NODES", "10000"))
+    
+    # Reduced precision for the embedding forward pass ("auto": float16 on GPU, float32 on CPU)
+    inference_dtype_name = os.getenv("RGCN_INFERENCE_DTYPE", "auto").lower()
+    if inference_dtype_name == "auto":
+        inference_dtype_name = "float16" if device.type == "cuda" else "float32"
+    inference_dtypes = {"float32": None, "float16": torch.float16, "bfloat16": torch.bfloat16}
+    if inference_dtype_name not in inference_dtypes:
+        raise ValueError(
+            f"Unknown RGCN_INFERENCE_DTYPE '{inference_dtype_name}'; "
+            f"expected one of: auto, {', '.join(inference_dtypes)}"
+        )
+    inference_dtype = inference_dtypes[inference_dtype_name]
+    
+    # Optionally compile the forward pass used for embeddings (training keeps the eager model,
+    # whose freshly sampled negative edges would keep breaking the captured graph)
+    compile_model = os.getenv("RGCN_COMPILE", "false").lower() in ("1", "true")
+    
+    embedding_service = EmbeddingService(
+        model, entity_to_node, node_to_entity, edge_index, edge_type,
+        ann_min_nodes=ann_min_nodes, inference_dtype=inference_dtype, compile_model=compile_model,
+        similarity_cache_size=int(os.getenv("RGCN_SIMILARITY_CACHE_SIZE", "4096"))
+    )
+    # First build also warms up the compiled model
+    _build_embedding_cache()
+    
+    # Concurrent /embeddings and /similar requests that queue up under load are served in batches
+    max_batch_size = int(os.getenv("RGCN_BATCH_MAX_SIZE", "64"))
+    embeddings_batcher = RequestBatcher(embedding_service.get_embeddings_batch, max_batch_size)
+    similarity_batcher = RequestBatcher(embedding_service.find_similar_entities_batch, max_batch_size)
+    embeddings_batcher.start()
+    similarity_batcher.start()
+    
     print("[R-GCN] Service ready!")
 
 
 @app.on_event("shutdown")
 async def shutdown():
     """Cleanup on shutdown."""
+    for batcher in (embeddings_batcher, similarity_batcher):
+        if batcher:
+            await batcher.stop()
     if neo4j_connector:
         neo4j_connector.close()
     print("[R-GCN] Shutdown complete.")
@@ -188,50 +259,63 @@ async def health():
 @app.get("/stats")
 async def get_stats():
     """Get usage statistics."""
-    return {
-        "total_queries": stats["total_queries"],
-        "avg_similarity_score": stats["avg_similarity"],
-        "embeddings_generated": stats["embeddings_count"]
-    }
+    with stats_lock:
+        return {
+            "total_queries": stats["total_queries"],
+            "avg_similarity_score": stats["avg_similarity"],
+            "embeddings_generated": stats["embeddings_count"]
+        }
 
 
 @app.post("/embeddings")
 async def get_embeddings(request: EmbeddingRequest):
     """Get embeddings for given entity IDs."""
-    if not model:
+    if not model or not embedding_service:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
-    stats["total_queries"] += 1
+    embeddings = await embeddings_batcher.submit(request.entity_ids)
     
-    from services.embedding_service import EmbeddingService
-    embedding_service = EmbeddingService(model, entity_to_node, node_to_entity)
+    with stats_lock:
+        stats["total_queries"] += 1
+        stats["embeddings_count"] += len(embeddings)
     
-    embeddings = embedding_service.get_embeddings(request.entity_ids)
-    
-    stats["embeddings_count"] += len(embeddings)
+    if request.encoding == "float16":
+        return ORJSONResponse({
+            "embeddings": {
+                eid: base64.b64encode(emb.astype("<f2").tobytes()).decode("ascii")
+                for eid, emb in embeddings.items()
+            },
+            "entity_ids": list(embeddings.keys()),
+            "dtype": "float16",
+            "shape": [model.embedding_dim]
+        })
     
-    return {
-        "embeddings": {eid: emb.tolist() for eid, emb in embeddings.items()},
+    # orjson serializes the numpy arrays directly, without building Python float lists
+    return ORJSONResponse({
+        "embeddings": embeddings,
         "entity_ids": list(embeddings.keys())
-    }
+    })
 
 
 @app.post("/similar")
 async def find_similar(request: SimilarityRequest):
     """Find similar entities using cosine similarity."""
-    if not model:
+    if not model or not embedding_service:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
-    stats["total_queries"] += 1
-    
-    from services.embedding_service import EmbeddingService
-    embedding_service = EmbeddingService(model, entity_to_node, node_to_entity)
+    # Cache hits are answered directly; only misses go through the batcher
+    similar = embedding_service.get_cached_similar(request.entity_id, request.top_k)
+    if similar is None:
+        similar = await similarity_batcher.submit((request.entity_id, request.top_k))
     
-    similar = embedding_service.find_similar_entities(request.entity_id, request.top_k)
-    
-    if similar:
-        avg_sim = sum(s["score"] for s in similar) / len(similar)
-        stats["avg_similarity"] = (stats["avg_similarity"] + avg_sim) / 2
+    with stats_lock:
+        stats["total_queries"] += 1
+        if similar:
+            # Running mean over all similarity queries that returned results
+            avg_sim = sum(s["score"] for s in similar) / len(similar)
+            n = stats["similarity_samples"]
+            stats["avg_similarity"] = (stats["avg_similarity"] * n + avg_sim) / (n + 1)
+            stats["similarity_samples"] = n + 1
     
     return {
         "entity_id": request.entity_id,
@@ -239,26 +323,55 @@ async def find_similar(request: SimilarityRequest):
     }
 
 
+def _build_embedding_cache():
+    """(Re)build the embedding cache, falling back to the eager model if the compiled one fails."""
+    try:
+        embedding_service.refresh()
+    except Exception as e:
+        if embedding_service.inference_model is embedding_service.inference_base:
+            raise
+        print(f"[R-GCN] torch.compile failed: {e}. Falling back to eager forward pass.")
+        embedding_service.inference_model = embedding_service.inference_base
+        embedding_service.refresh()
+
+
+def _run_training(epochs: int) -> List[float]:
+    """Train the model, save the weights and refresh cached embeddings."""
+    # Never run two trainings on the shared model at once
+    with training_lock:
+        model.train()
+        
+        losses = []
+        for epoch in range(epochs):
+            loss = trainer.train_epoch()
+            losses.append(loss)
+            if (epoch + 1) % 10 == 0:
+                print(f"[R-GCN] Epoch {epoch + 1}/{epochs}, Loss: {loss:.4f}")
+        
+        model.eval()
+        
+        # Save model first so the trained weights survive a failed cache rebuild
+        model_path = os.getenv("RGCN_MODEL_PATH", "model.pt")
+        torch.save(model.state_dict(), model_path)
+        
+        # Rebuild cached embeddings from the new weights
+        if embedding_service:
+            _build_embedding_cache()
+    
+    return losses
+
+
 @app.post("/train")
 async def train_model(request: TrainRequest):
     """Trigger model training."""
     if not model or not trainer:
         raise HTTPException(status_code=503, detail="Model or trainer not initialized")
     
-    model.train()
+    # Training is blocking PyTorch work; run it in a worker thread so the event
+    # loop keeps serving other requests meanwhile
+    losses = await asyncio.to_thread(_run_training, request.epochs)
     
-    losses = []
-    for epoch in range(request.epochs):
-        loss = trainer.train_epoch()
-        losses.append(loss)
-        if (epoch + 1) % 10 == 0:
-            print(f"[R-GCN] Epoch {epoch + 1}/{request.epochs}, Loss: {loss:.4f}")
-    
-    model.eval()
-    
-    # Save model
     model_path = os.getenv("RGCN_MODEL_PATH", "model.pt")
-    torch.save(model.state_dict(), model_path)
     
     return {
         "status": "success",
@@ -275,11 +388,9 @@ async def evaluate_graph(request: EvaluateRequest):
     
     Computes precision@k, recall@k, accuracy and F1 score over a sample of nodes.
     """
-    if not model or not graph_data_cache:
+    if not model or not embedding_service or not graph_data_cache:
         raise HTTPException(status_code=503, detail="Model or graph data not initialized")
 
-    from services.embedding_service import EmbeddingService
-
     # Build adjacency list (treat relations as undirected for evaluation)
     edges = graph_data_cache.get("edges")
     entity_ids = graph_data_cache.get("entity_ids", [])
@@ -317,7 +428,6 @@ async def evaluate_graph(request: EvaluateRequest):
     eval_indices = candidate_indices[: max(1, min(request.max_nodes, len(candidate_indices)))]
 
     # Prepare embeddings matrix aligned with entity_ids order
-    embedding_service = EmbeddingService(model, entity_to_node, node_to_entity)
     all_embeddings = embedding_service.get_embeddings()  # dict[entity_id] -> np.ndarray
 
     if not all_embeddings:
@@ -18,15 +18,20 @@ class RGCNModel(nn.Module):
         embedding_dim: Dimension of node embeddings (default: 64)
         hidden_dim: Dimension of hidden layers (default: 128)
         num_layers: Number of R-GCN layers (default: 2)
+        num_bases: Number of bases for weight decomposition, used when there are more
+            relation types than bases; None keeps one weight matrix per relation (default: None)
     """
     
-    def __init__(self, num_nodes, num_relations, embedding_dim=64, hidden_dim=128, num_layers=2):
+    def __init__(self, num_nodes, num_relations, embedding_dim=64, hidden_dim=128, num_layers=2, num_bases=None):
         super(RGCNModel, self).__init__()
         self.num_nodes = num_nodes
         self.num_relations = num_relations
         self.embedding_dim = embedding_dim
         self.hidden_dim = hidden_dim
         self.num_layers = num_layers
+        # Basis decomposition shares num_bases matrices across relations instead of
+        # storing one per relation; it only saves memory when there are more relations
+        self.num_bases = num_bases if num_bases is not None and num_relations > num_bases else None
         
         # Node embeddings (learnable initial embeddings)
         self.node_embedding = nn.Embedding(num_nodes, embedding_dim)
@@ -39,16 +44,16 @@ class RGCNModel(nn.Module):
         
         # First layer: embedding_dim -> hidden_dim
         if num_layers == 1:
-            self.convs.append(RGCNConv(embedding_dim, embedding_dim, num_relations))
+            self.convs.append(RGCNConv(embedding_dim, embedding_dim, num_relations, num_bases=self.num_bases))
         else:
-            self.convs.append(RGCNConv(embedding_dim, hidden_dim, num_relations))
+            self.convs.append(RGCNConv(embedding_dim, hidden_dim, num_relations, num_bases=self.num_bases))
             
             # Hidden layers: hidden_dim -> hidden_dim
             for _ in range(num_layers - 2):
-                self.convs.append(RGCNConv(hidden_dim, hidden_dim, num_relations))
+                self.convs.append(RGCNConv(hidden_dim, hidden_dim, num_relations, num_bases=self.num_bases))
             
             # Final layer: hidden_dim -> embedding_dim
-            self.convs.append(RGCNConv(hidden_dim, embedding_dim, num_relations))
+            self.convs.append(RGCNConv(hidden_dim, embedding_dim, num_relations, num_bases=self.num_bases))
         
     def forward(self, edge_index, edge_type):
         """
@@ -64,7 +69,8 @@ class RGCNModel(nn.Module):
         x = self.node_embedding.weight
         
         for i, conv in enumerate(self.convs):
-            x = conv(x, edge_index, edge_type)
+            # RGCNConv accumulates in FP32; keep a reduced-precision model in its own dtype
+            x = conv(x.to(self.node_embedding.weight.dtype), edge_index, edge_type)
             # Apply ReLU activation except for the last layer
             if i < len(self.convs) - 1:
                 x = F.relu(x)
@@ -93,6 +99,9 @@ class RGCNTrainer:
     Trainer for R-GCN model using link prediction as the training objective.
     """
     
+    # Rounds of redrawing negative edges that turned out to be real edges
+    NEGATIVE_RESAMPLE_ROUNDS = 2
+    
     def __init__(self, model, edge_index, edge_type, num_negative_samples=1):
         self.model = model
         self.edge_index = edge_index
@@ -100,6 +109,19 @@ class RGCNTrainer:
         self.num_negative_samples = num_negative_samples
         self.optimizer = torch.optim.Adam(model.parameters(), lr=0.01, weight_decay=5e-4)
         
+        # Negative edges are resampled in place so no new tensors are allocated per epoch
+        device = edge_index.device
+        num_negatives = edge_index.size(1) * num_negative_samples
+        self._neg_edges = torch.empty((2, num_negatives), dtype=torch.long, device=device)
+        self._neg_resample = torch.empty_like(self._neg_edges)
+        
+        # Sorted hashes (source * num_nodes + target) of existing edges, to reject them as negatives
+        self._edge_hash = torch.unique(edge_index[0] * model.num_nodes + edge_index[1])
+        
+        # Device-side RNG for negative sampling
+        self._generator = torch.Generator(device=device)
+        self._generator.seed()
+        
     def train_epoch(self):
         """Train for one epoch using link prediction."""
         self.model.train()
@@ -135,11 +157,21 @@ class RGCNTrainer:
     def _sample_negative_edges(self):
         """Sample negative edges (non-existing edges)."""
         num_nodes = self.model.num_nodes
-        num_edges = self.edge_index.size(1)
         
-        # Sample random negative edges
-        neg_source = torch.randint(0, num_nodes, (num_edges * self.num_negative_samples,))
-        neg_target = torch.randint(0, num_nodes, (num_edges * self.num_negative_samples,))
+        # Fill the preallocated buffer with random node pairs
+        neg_edges = self._neg_edges.random_(0, num_nodes, generator=self._generator)
         
-        return torch.stack([neg_source, neg_target])
-
+        num_hashes = self._edge_hash.numel()
+        if num_hashes == 0:
+            return neg_edges
+        
+        # Redraw pairs that are existing edges, a fixed number of rounds. The membership
+        # test is a binary search into the sorted hashes, so it never syncs with the host
+        for _ in range(self.NEGATIVE_RESAMPLE_ROUNDS):
+            neg_hash = neg_edges[0] * num_nodes + neg_edges[1]
+            pos = torch.searchsorted(self._edge_hash, neg_hash).clamp_(max=num_hashes - 1)
+            is_edge = self._edge_hash[pos] == neg_hash
+            self._neg_resample.random_(0, num_nodes, generator=self._generator)
+            neg_edges.copy_(torch.where(is_edge, self._neg_resample, neg_edges))
+        
+        return neg_edges
@@ -1,16 +1,32 @@
 """
 Service for generating and managing node embeddings using R-GCN.
 """
+import copy
+import threading
+from collections import OrderedDict
+
 import torch
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from typing import List, Dict, Tuple, Optional
 
+try:
+    import hnswlib
+except ImportError:  # ANN search is optional; fall back to exact search
+    hnswlib = None
+
 
 class EmbeddingService:
     """Service for computing embeddings and similarity scores."""
     
-    def __init__(self, model, entity_to_node: Dict[str, int], node_to_entity: Dict[int, str]):
+    # Queries asking for more neighbors than this use exact search even when an HNSW index exists
+    ANN_MAX_TOP_K = 100
+    # Query rows scored per matrix product in exact search, bounding the [rows, num_nodes] score block
+    EXACT_SCORE_CHUNK = 16
+    
+    def __init__(self, model, entity_to_node: Dict[str, int], node_to_entity: Dict[int, str],
+                 edge_index: Optional[torch.Tensor] = None, edge_type: Optional[torch.Tensor] = None,
+                 ann_min_nodes: int = 10000, inference_dtype: Optional[torch.dtype] = None,
+                 compile_model: bool = False, similarity_cache_size: int = 4096):
         """
         Initialize embedding service.
         
@@ -18,11 +34,121 @@ class EmbeddingService:
             model: Trained R-GCN model
             entity_to_node: Mapping from entity ID to node index
             node_to_entity: Mapping from node index to entity ID
+            edge_index: Graph edges for the R-GCN forward pass, shape [2, num_edges]
+            edge_type: Relation type of each edge, shape [num_edges]
+            ann_min_nodes: Minimum graph size for using an HNSW index (requires hnswlib)
+            inference_dtype: Optional reduced precision (e.g. torch.float16) for the forward pass,
+                run on a separate copy of the model so training keeps its FP32 weights
+            compile_model: If True, run the forward pass through torch.compile
+            similarity_cache_size: Maximum number of (entity_id, top_k) results kept in the LRU cache
         """
         self.model = model
         self.entity_to_node = entity_to_node
         self.node_to_entity = node_to_entity
-        self._embeddings_cache = None
+        self.edge_index = edge_index
+        self.edge_type = edge_type
+        self.ann_min_nodes = ann_min_nodes
+        self.inference_dtype = inference_dtype
+        
+        # Reduced-precision copy of the model used only for embeddings; its weights are
+        # reloaded from the training model on every cache build
+        if inference_dtype is None:
+            self.inference_base = model
+        else:
+            self.inference_base = copy.deepcopy(model).to(inference_dtype)
+            self.inference_base.eval()
+            self.inference_base.requires_grad_(False)
+        
+        # A compiled module shares its parameters with inference_base, so reloads reach it too
+        if compile_model:
+            self.inference_model = torch.compile(self.inference_base, mode="reduce-overhead", fullgraph=False)
+        else:
+            self.inference_model = self.inference_base
+        
+        # Snapshot of cached embeddings: "matrix", "norm", "ann_index" and the lazily built
+        # "by_entity" dict. It is only ever replaced as a whole, under _cache_lock
+        self._cache: Optional[Dict] = None
+        self._cache_lock = threading.Lock()
+        
+        # LRU cache of similarity results keyed on (entity_id, top_k)
+        self.similarity_cache_size = similarity_cache_size
+        self._similarity_cache: OrderedDict = OrderedDict()
+        self._similarity_cache_lock = threading.Lock()
+        self._cache_generation = 0
+    
+    def refresh(self):
+        """
+        Rebuild cached embeddings from the current model weights.
+        
+        Readers keep using the previous snapshot until the new one is swapped in.
+        """
+        with self._cache_lock:
+            self._cache = self._build_cache()
+        
+        with self._similarity_cache_lock:
+            self._similarity_cache.clear()
+            # Results computed from the old embeddings must not be stored afterwards
+            self._cache_generation += 1
+    
+    def _get_cache(self) -> Dict:
+        """Get the current cache snapshot, building it on first use."""
+        cache = self._cache
+        if cache is None:
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = self._build_cache()
+                cache = self._cache
+        return cache
+    
+    def _build_cache(self) -> Dict:
+        """Compute the embedding matrix, its normalized copy and the ANN index."""
+        with torch.no_grad():
+            if self.inference_base is not self.model:
+                # Pick up the latest trained weights, cast to the inference dtype
+                self.inference_base.load_state_dict(self.model.state_dict())
+            
+            if self.edge_index is not None:
+                # Message-passed output of the R-GCN, computed once per cache build
+                emb = self.inference_model(self.edge_index, self.edge_type)
+            else:
+                emb = self.model.node_embedding.weight
+            emb = emb.detach().float().cpu().numpy()
+        emb = np.ascontiguousarray(emb, dtype=np.float32)
+        norms = np.linalg.norm(emb, axis=1, keepdims=True)
+        # Guard against zero vectors so normalization never divides by zero
+        emb_norm = emb / np.maximum(norms, 1e-12)
+        
+        return {
+            "matrix": emb,
+            "norm": emb_norm,
+            "ann_index": self._build_ann_index(emb_norm),
+            "by_entity": None
+        }
+    
+    def get_embedding_matrix(self, normalized: bool = False) -> np.ndarray:
+        """
+        Get the embedding matrix for all nodes, building it on first use.
+        
+        Args:
+            normalized: If True, return the L2-normalized rows instead
+            
+        Returns:
+            Array of shape [num_nodes, embedding_dim]
+        """
+        cache = self._get_cache()
+        return cache["norm"] if normalized else cache["matrix"]
+    
+    def _build_ann_index(self, norm_matrix: np.ndarray):
+        """Build an HNSW index over normalized embeddings, or None for small graphs."""
+        num_nodes, embedding_dim = norm_matrix.shape
+        if hnswlib is None or num_nodes < self.ann_min_nodes:
+            return None
+        
+        index = hnswlib.Index(space='cosine', dim=embedding_dim)
+        index.init_index(max_elements=num_nodes, ef_construction=200, M=16)
+        index.add_items(norm_matrix, ids=np.arange(num_nodes))
+        index.set_ef(64)
+        return index
     
     def get_embeddings(self, entity_ids: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
         """
@@ -35,32 +161,46 @@ class EmbeddingService:
             Dictionary mapping entity_id to embedding array
         """
         if entity_ids is None:
-            # Return all embeddings
-            with torch.no_grad():
-                embeddings = self.model.node_embedding.weight.cpu().numpy()
-            
-            result = {}
-            for node_idx, entity_id in self.node_to_entity.items():
-                result[entity_id] = embeddings[node_idx]
-            return result
+            # Return all embeddings; the dict belongs to the snapshot it was built from
+            cache = self._get_cache()
+            if cache["by_entity"] is None:
+                embeddings = cache["matrix"]
+                cache["by_entity"] = {
+                    entity_id: embeddings[node_idx]
+                    for node_idx, entity_id in self.node_to_entity.items()
+                }
+            return cache["by_entity"]
         else:
-            # Get embeddings for specific entities
-            node_indices = []
-            valid_entity_ids = []
-            
-            for entity_id in entity_ids:
-                if entity_id in self.entity_to_node:
-                    node_indices.append(self.entity_to_node[entity_id])
-                    valid_entity_ids.append(entity_id)
-            
-            if not node_indices:
-                return {}
-            
-            with torch.no_grad():
-                node_tensor = torch.tensor(node_indices, dtype=torch.long)
-                embeddings = self.model.node_embedding(node_tensor).cpu().numpy()
+            return self.get_embeddings_batch([entity_ids])[0]
+    
+    def get_embeddings_batch(self, requests: List[List[str]]) -> List[Dict[str, np.ndarray]]:
+        """
+        Get embeddings for several requests with a single gather.
+        
+        Args:
+            requests: One list of entity IDs per request
             
-            return dict(zip(valid_entity_ids, embeddings))
+        Returns:
+            One dictionary mapping entity_id to embedding array per request
+        """
+        valid_ids = [
+            [entity_id for entity_id in entity_ids if entity_id in self.entity_to_node]
+            for entity_ids in requests
+        ]
+        node_indices = [self.entity_to_node[entity_id] for ids in valid_ids for entity_id in ids]
+        
+        if not node_indices:
+            return [{} for _ in requests]
+        
+        embeddings = self.get_embedding_matrix()[node_indices]
+        
+        # Slice the gathered rows back out per request
+        results = []
+        offset = 0
+        for ids in valid_ids:
+            results.append(dict(zip(ids, embeddings[offset:offset + len(ids)])))
+            offset += len(ids)
+        return results
     
     def find_similar_entities(self, entity_id: str, top_k: int = 10) -> List[Dict]:
         """
@@ -73,35 +213,133 @@ class EmbeddingService:
         Returns:
             List of dictionaries with 'entity_id', 'score', and 'label'
         """
-        if entity_id not in self.entity_to_node:
-            return []
+        return self.find_similar_entities_batch([(entity_id, top_k)])[0]
+    
+    def get_cached_similar(self, entity_id: str, top_k: int = 10) -> Optional[List[Dict]]:
+        """
+        Look up a similarity result in the LRU cache without computing anything.
         
-        # Get embedding for query entity
-        query_embedding = self.get_embeddings([entity_id])
-        if not query_embedding:
-            return []
+        Args:
+            entity_id: Entity ID to find similar entities for
+            top_k: Number of similar entities to return
+            
+        Returns:
+            The cached result list, or None on a cache miss
+        """
+        key = (entity_id, top_k)
+        with self._similarity_cache_lock:
+            cached = self._similarity_cache.get(key)
+            if cached is None:
+                return None
+            self._similarity_cache.move_to_end(key)
+            return list(cached)
+    
+    def find_similar_entities_batch(self, queries: List[Tuple[str, int]]) -> List[List[Dict]]:
+        """
+        Find similar entities for several queries at once.
         
-        query_emb = query_embedding[entity_id].reshape(1, -1)
+        Args:
+            queries: List of (entity_id, top_k) pairs
+            
+        Returns:
+            One result list (as returned by find_similar_entities) per query
+        """
+        results = [[] for _ in queries]
+        
+        generation = self._cache_generation
+        cache = self._get_cache()
+        norm_matrix = cache["norm"]
+        ann_index = cache["ann_index"]
         
-        # Get all embeddings
-        all_embeddings = self.get_embeddings()
+        # Serve repeated queries from the LRU cache
+        cached_positions = set()
+        with self._similarity_cache_lock:
+            for pos, key in enumerate(queries):
+                cached = self._similarity_cache.get(key)
+                if cached is not None:
+                    self._similarity_cache.move_to_end(key)
+                    results[pos] = list(cached)
+                    cached_positions.add(pos)
         
-        # Compute similarities
-        similarities = []
-        for other_entity_id, other_emb in all_embeddings.items():
-            if other_entity_id == entity_id:
+        # (position in queries, query node index, clamped top_k) for answerable queries
+        pending = []
+        for pos, (entity_id, top_k) in enumerate(queries):
+            if pos in cached_positions:
                 continue
+            top_k = min(top_k, len(norm_matrix) - 1)
+            if entity_id in self.entity_to_node and top_k > 0:
+                pending.append((pos, self.entity_to_node[entity_id], top_k))
+        
+        if not pending:
+            return results
+        
+        exact_pending = pending
+        if ann_index is not None:
+            # Group ANN queries by top_k so each knn_query asks for exactly what it needs;
+            # very large top_k values go straight to exact search
+            exact_pending = []
+            ann_groups = {}
+            for item in pending:
+                if item[2] > self.ANN_MAX_TOP_K:
+                    exact_pending.append(item)
+                else:
+                    ann_groups.setdefault(item[2], []).append(item)
             
-            similarity = cosine_similarity(query_emb, other_emb.reshape(1, -1))[0][0]
-            similarities.append({
-                'entity_id': other_entity_id,
-                'score': float(similarity),
-                'label': 'Entity'  # Could be enhanced with actual labels
-            })
+            for top_k, group in ann_groups.items():
+                group_indices = np.array([query_idx for _, query_idx, _ in group])
+                try:
+                    # Ask for one extra neighbor since the query finds itself
+                    labels, distances = ann_index.knn_query(norm_matrix[group_indices], k=top_k + 1)
+                except RuntimeError:
+                    # HNSW could not return top_k + 1 neighbors; score these exactly instead
+                    exact_pending.extend(group)
+                    continue
+                
+                for row, (pos, query_idx, _) in enumerate(group):
+                    neighbors = [
+                        (int(idx), 1.0 - float(dist))
+                        for idx, dist in zip(labels[row], distances[row])
+                        if idx != query_idx
+                    ][:top_k]
+                    results[pos] = self._format_neighbors(neighbors)
+        
+        num_nodes = len(norm_matrix)
+        for start in range(0, len(exact_pending), self.EXACT_SCORE_CHUNK):
+            chunk = exact_pending[start:start + self.EXACT_SCORE_CHUNK]
+            query_indices = np.array([query_idx for _, query_idx, _ in chunk])
+            
+            # Cosine similarity of a chunk of queries against every node in one matrix product
+            scores = norm_matrix[query_indices] @ norm_matrix.T
+            scores[np.arange(len(chunk)), query_indices] = -np.inf
+            
+            for row, (pos, _, top_k) in enumerate(chunk):
+                row_scores = scores[row]
+                # Partial sort for the top_k candidates, then order just those
+                top_indices = np.argpartition(row_scores, num_nodes - top_k)[num_nodes - top_k:]
+                top_indices = top_indices[np.argsort(-row_scores[top_indices])]
+                results[pos] = self._format_neighbors(
+                    (int(idx), float(row_scores[idx])) for idx in top_indices
+                )
         
-        # Sort by similarity and return top_k
-        similarities.sort(key=lambda x: x['score'], reverse=True)
-        return similarities[:top_k]
+        with self._similarity_cache_lock:
+            if generation == self._cache_generation:
+                for pos, _, _ in pending:
+                    self._similarity_cache[queries[pos]] = list(results[pos])
+                while len(self._similarity_cache) > self.similarity_cache_size:
+                    self._similarity_cache.popitem(last=False)
+        
+        return results
+    
+    def _format_neighbors(self, neighbors) -> List[Dict]:
+        """Convert (node index, score) pairs into similarity result dictionaries."""
+        return [
+            {
+                'entity_id': self.node_to_entity[idx],
+                'score': score,
+                'label': 'Entity'  # Could be enhanced with actual labels
+            }
+            for idx, score in neighbors
+        ]
     
     def compute_similarity_matrix(self, entity_ids: List[str]) -> np.ndarray:
         """
@@ -113,18 +351,12 @@ class EmbeddingService:
         Returns:
             Similarity matrix of shape [len(entity_ids), len(entity_ids)]
         """
-        embeddings = self.get_embeddings(entity_ids)
-        
-        if not embeddings:
-            return np.array([])
-        
-        # Build embedding matrix
-        emb_matrix = np.array([embeddings[eid] for eid in entity_ids if eid in embeddings])
+        node_indices = [self.entity_to_node[eid] for eid in entity_ids if eid in self.entity_to_node]
         
-        if emb_matrix.size == 0:
+        if not node_indices:
             return np.array([])
         
-        # Compute cosine similarity
-        similarity_matrix = cosine_similarity(emb_matrix)
-        return similarity_matrix
+        # Rows are already L2-normalized, so cosine similarity is a plain matrix product
+        rows = self.get_embedding_matrix(normalized=True)[node_indices]
+        return rows @ rows.T
 
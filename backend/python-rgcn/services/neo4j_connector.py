@@ -1,6 +1,7 @@
 """
 Neo4j connector for extracting graph data for R-GCN training.
 """
+from concurrent.futures import ThreadPoolExecutor
 from neo4j import GraphDatabase
 import numpy as np
 from typing import Dict, List, Tuple, Optional
@@ -9,6 +10,9 @@ from typing import Dict, List, Tuple, Optional
 class Neo4jConnector:
     """Connector to extract graph structure from Neo4j for R-GCN training."""
     
+    # Records per Bolt fetch when streaming graph data
+    FETCH_SIZE = 10000
+    
     def __init__(self, uri: str, user: str, password: str):
         """
         Initialize Neo4j connection.
@@ -47,7 +51,58 @@ class Neo4jConnector:
             - edge_types: Array of edge type indices
             - rel_type_map: Mapping from relation type names to indices
         """
-        with self.driver.session() as session:
+        # Nodes and edges are streamed concurrently on separate sessions
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            nodes_future = executor.submit(self._fetch_nodes)
+            edges_future = executor.submit(self._fetch_edges)
+            neo4j_ids, entity_ids, labels = nodes_future.result()
+            raw_edges, rel_types, rel_type_map = edges_future.result()
+        
+        if len(entity_ids) == 0:
+            return {
+                "node_map": {},
+                "entity_ids": [],
+                "labels": [],
+                "edges": np.array([[], []], dtype=np.int64),
+                "edge_types": np.array([], dtype=np.int64),
+                "rel_type_map": {}
+            }
+        
+        node_map = {neo4j_id: idx for idx, neo4j_id in enumerate(neo4j_ids)}  # neo4j_id -> index
+        
+        # Map Neo4j IDs to node indices; nodes come back sorted by Neo4j ID
+        sorted_ids = np.asarray(neo4j_ids, dtype=np.int64)
+        positions = np.searchsorted(sorted_ids, raw_edges)
+        known = sorted_ids[np.minimum(positions, len(sorted_ids) - 1)] == raw_edges
+        
+        # Skip edges whose endpoints are not in our node map; the result is a
+        # contiguous [2, num_edges] array, the layout RGCNConv consumes
+        keep = known.all(axis=0)
+        edges_array = np.compress(keep, positions, axis=1)
+        edge_types_array = rel_types[keep]
+        
+        if not keep.all():
+            # Drop relation types that only occurred on skipped edges
+            used = np.unique(edge_types_array)
+            remap = np.full(len(rel_type_map), -1, dtype=np.int64)
+            remap[used] = np.arange(len(used))
+            edge_types_array = remap[edge_types_array]
+            rel_type_map = {
+                rel_type: int(remap[idx]) for rel_type, idx in rel_type_map.items() if remap[idx] >= 0
+            }
+        
+        return {
+            "node_map": node_map,
+            "entity_ids": entity_ids,
+            "labels": labels,
+            "edges": edges_array,
+            "edge_types": edge_types_array,
+            "rel_type_map": rel_type_map
+        }
+    
+    def _fetch_nodes(self) -> Tuple[List[int], List[str], List[str]]:
+        """Fetch graph nodes as (neo4j_ids, entity_ids, labels), ordered by Neo4j ID."""
+        with self.driver.session(fetch_size=self.FETCH_SIZE) as session:
             # Get all nodes (excluding Document and Chunk nodes)
             nodes_result = session.run("""
                 MATCH (n)
@@ -57,25 +112,27 @@ class Neo4jConnector:
                 ORDER BY neo4j_id
             """)
             
-            node_map = {}  # neo4j_id -> index
+            neo4j_ids = []
             entity_ids = []
             labels = []
             
             for idx, record in enumerate(nodes_result):
-                neo4j_id = record["neo4j_id"]
-                node_map[neo4j_id] = idx
+                neo4j_ids.append(record["neo4j_id"])
                 entity_ids.append(record["entity_id"] or f"node_{idx}")
                 labels.append(record["label"] or "Entity")
             
-            if len(entity_ids) == 0:
-                return {
-                    "node_map": {},
-                    "entity_ids": [],
-                    "labels": [],
-                    "edges": np.array([[], []], dtype=np.int64),
-                    "edge_types": np.array([], dtype=np.int64),
-                    "rel_type_map": {}
-                }
+            return neo4j_ids, entity_ids, labels
+    
+    def _fetch_edges(self) -> Tuple[np.ndarray, np.ndarray, Dict[str, int]]:
+        """Fetch graph edges as (Neo4j IDs of shape [2, num_edges], edge types, rel_type_map)."""
+        with self.driver.session(fetch_size=self.FETCH_SIZE) as session:
+            # Count edges first so the arrays can be allocated up front
+            edge_count = session.run("""
+                MATCH (a)-[r]->(b)
+                WHERE NOT a:Document AND NOT a:Chunk
+                  AND NOT b:Document AND NOT b:Chunk
+                RETURN count(r) as edge_count
+            """).single()["edge_count"]
             
             # Get all edges with relationship types
             edges_result = session.run("""
@@ -85,38 +142,29 @@ class Neo4jConnector:
                 RETURN id(a) as source, id(b) as target, type(r) as rel_type
             """)
             
-            edges = []
-            rel_types = []
+            # One row of sources and one of targets
+            edges = np.empty((2, edge_count), dtype=np.int64)
+            rel_types = np.empty(edge_count, dtype=np.int64)
             rel_type_map = {}  # rel_type -> index
+            num_edges = 0
             
             for record in edges_result:
-                source_neo4j = record["source"]
-                target_neo4j = record["target"]
-                rel_type = record["rel_type"] or "RELATED_TO"
+                # The graph may have grown since it was counted
+                if num_edges == edge_count:
+                    break
                 
-                # Skip if nodes not in our node map
-                if source_neo4j not in node_map or target_neo4j not in node_map:
-                    continue
+                rel_type = record["rel_type"] or "RELATED_TO"
                 
                 # Map relation type to index
                 if rel_type not in rel_type_map:
                     rel_type_map[rel_type] = len(rel_type_map)
                 
-                edges.append([node_map[source_neo4j], node_map[target_neo4j]])
-                rel_types.append(rel_type_map[rel_type])
-            
-            # Convert to numpy arrays
-            edges_array = np.array(edges, dtype=np.int64).T if edges else np.array([[], []], dtype=np.int64)
-            edge_types_array = np.array(rel_types, dtype=np.int64) if rel_types else np.array([], dtype=np.int64)
+                edges[0, num_edges] = record["source"]
+                edges[1, num_edges] = record["target"]
+                rel_types[num_edges] = rel_type_map[rel_type]
+                num_edges += 1
             
-            return {
-                "node_map": node_map,
-                "entity_ids": entity_ids,
-                "labels": labels,
-                "edges": edges_array,
-                "edge_types": edge_types_array,
-                "rel_type_map": rel_type_map
-            }
+            return edges[:, :num_edges], rel_types[:num_edges], rel_type_map
     
     def get_entity_chunks(self, entity_ids: List[str]) -> Dict[str, List[str]]:
         """
@@ -0,0 +1,95 @@
+"""
+Dynamic request batching for the embedding endpoints.
+"""
+import asyncio
+from typing import Any, Callable, List, Optional
+
+
+class RequestBatcher:
+    """
+    Groups concurrent requests into a single batched call.
+
+    An idle batcher dispatches a request immediately. Requests that arrive while a
+    handler call is running queue up and are handed to the next call together (up
+    to max_batch_size of them), so batching only happens under load and adds no
+    latency otherwise. The handler runs in a worker thread and must return one
+    result per item, in the same order.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 64):
+        """
+        Initialize the batcher.
+
+        Args:
+            handler: Function mapping a list of items to a list of results
+            max_batch_size: Maximum number of items per handler call
+        """
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background worker on the running event loop."""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background worker and cancel requests still waiting."""
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue an item and wait for its result.
+
+        Args:
+            item: Single request payload passed to the handler as part of a batch
+
+        Returns:
+            The handler's result for this item
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        """Collect pending requests into batches and dispatch them."""
+        while True:
+            batch = [await self._queue.get()]
+
+            # Take whatever queued up while the previous batch was running; never wait
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            items = [item for item, _ in batch]
+            try:
+                results = await asyncio.to_thread(self.handler, items)
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                # The caller may have gone away (e.g. client disconnect)
+                if not future.done():
+                    future.set_result(result)